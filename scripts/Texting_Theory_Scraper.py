@@ -2,21 +2,28 @@
 """
 Download images from r/Textingtheory without re-downloading duplicates.
 
-State is kept in:
-  ~/texting_theory_screenshots/.download_state.json
-Fields:
-  - seen_post_ids: list of Reddit submission IDs already processed
-  - seen_hashes: list of SHA256 hashes of downloaded files
+State is kept in a SQLite database:
+  ~/texting_theory_screenshots/.download_state.db
+Tables:
+  - seen_posts(id): Reddit submission IDs already processed
+  - seen_hashes(h): 128-bit BLAKE3 digest of each downloaded file
+  - seen_urls(url, h): image URLs already fetched, with their content hash
+State from the older .download_state.json file is imported on first run.
 """
-import hashlib
+import contextlib
 import json
 import os
+import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse, unquote
 
-import praw
 import requests
+from blake3 import blake3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Optional: load .env if available (won't crash if missing)
 try:
@@ -27,9 +34,16 @@ except Exception:
 
 # === Config ===
 SUBREDDIT = "Textingtheory"
+REDDIT_TOKEN_URL = "https://www.reddit.com/api/v1/access_token"
+REDDIT_API_BASE = "https://oauth.reddit.com"
 SAVE_DIR = os.path.join(os.path.expanduser("~"), "texting_theory_screenshots")
-STATE_PATH = os.path.join(SAVE_DIR, ".download_state.json")
+STATE_PATH = os.path.join(SAVE_DIR, ".download_state.db")
+LEGACY_JSON_PATH = os.path.join(SAVE_DIR, ".download_state.json")
 POST_LIMIT = 100  # change as needed; this is per run
+MAX_WORKERS = 8  # concurrent image downloads
+HASH_BYTES = 16  # BLAKE3 digest length used for content dedup
+CHUNK_SIZE = 64 * 1024  # bytes per streamed read; large enough to keep hashing efficient
+WRITE_BUFFER_SIZE = 1024 * 1024  # batch streamed chunks into fewer write syscalls
 
 # === Credentials ===
 CLIENT_ID = (os.getenv("REDDIT_CLIENT_ID") or "").strip()
@@ -38,37 +52,120 @@ USER_AGENT = (os.getenv("REDDIT_USER_AGENT") or "textingtheory_downloader/0.1 by
 
 if not CLIENT_ID or not CLIENT_SECRET:
     print("⚠️  Missing Reddit credentials. Set REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET (via .env or env vars).")
-    # You can continue unauthenticated for some endpoints, but PRAW prefers creds. Exit to be explicit:
+    # The public .json listings work without creds but are heavily rate-limited. Exit to be explicit:
     sys.exit(1)
 
+# Serializes use of the state connection, which download workers share
+_db_lock = threading.Lock()
+
 # === Helpers ===
 def ensure_dirs():
     os.makedirs(SAVE_DIR, exist_ok=True)
 
-def load_state():
-    if not os.path.exists(STATE_PATH):
-        return {"seen_post_ids": [], "seen_hashes": []}
+def make_session() -> requests.Session:
+    # One pooled keep-alive session for the listing and all downloads; most images come from the same CDN host
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def open_state() -> sqlite3.Connection:
+    """
+    Open (creating if needed) the state database.
+    On first run, the older JSON state and the images already on disk are imported.
+    """
+    conn = sqlite3.connect(STATE_PATH, check_same_thread=False)
+    # WAL keeps each commit cheap and the database consistent if a run is killed
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute("CREATE TABLE IF NOT EXISTS seen_posts(id TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS seen_hashes(h BLOB PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS seen_urls(url TEXT PRIMARY KEY, h BLOB) WITHOUT ROWID")
+        # user_version marks the import as done; it commits (or rolls back) together with it
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+            if os.path.exists(LEGACY_JSON_PATH):
+                import_legacy_json(conn)
+            import_existing_files(conn)
+            conn.execute("PRAGMA user_version = 1")
+    return conn
+
+def import_legacy_json(conn: sqlite3.Connection):
     try:
-        with open(STATE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(LEGACY_JSON_PATH, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
     except Exception:
         # corrupt or unreadable; start fresh but back up the bad file
         try:
-            os.rename(STATE_PATH, STATE_PATH + ".corrupt")
+            os.rename(LEGACY_JSON_PATH, LEGACY_JSON_PATH + ".corrupt")
         except Exception:
             pass
-        return {"seen_post_ids": [], "seen_hashes": []}
-
-def save_state(state):
-    tmp = STATE_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2, sort_keys=True)
-    os.replace(tmp, STATE_PATH)
-
-def sha256_bytes(data: bytes) -> str:
-    h = hashlib.sha256()
-    h.update(data)
-    return h.hexdigest()
+        return
+    # Its SHA256 hashes can't match BLAKE3 digests; import_existing_files rebuilds them from the files
+    conn.executemany("INSERT OR IGNORE INTO seen_posts VALUES (?)", ((pid,) for pid in legacy.get("seen_post_ids", [])))
+
+def hash_file(path: str) -> bytes:
+    h = blake3()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.digest(length=HASH_BYTES)
+
+def import_existing_files(conn: sqlite3.Connection):
+    # Hash images already in SAVE_DIR so reposts of archived content are still caught as duplicates
+    rows = []
+    for entry in os.scandir(SAVE_DIR):
+        if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(".part"):
+            rows.append((hash_file(entry.path),))
+    conn.executemany("INSERT OR IGNORE INTO seen_hashes VALUES (?)", rows)
+
+def _exists(conn: sqlite3.Connection, sql: str, params: tuple) -> bool:
+    with _db_lock:
+        return conn.execute(sql, params).fetchone() is not None
+
+def _write(conn: sqlite3.Connection, sql: str, params: tuple) -> int:
+    # Commit each write so a crash mid-run keeps everything done so far; returns rows changed
+    with _db_lock, conn:
+        return conn.execute(sql, params).rowcount
+
+def is_post_seen(conn, post_id: str) -> bool:
+    return _exists(conn, "SELECT 1 FROM seen_posts WHERE id = ?", (post_id,))
+
+def mark_post_seen(conn, post_id: str):
+    _write(conn, "INSERT OR IGNORE INTO seen_posts VALUES (?)", (post_id,))
+
+def is_url_seen(conn, url: str) -> bool:
+    return _exists(conn, "SELECT 1 FROM seen_urls WHERE url = ?", (url,))
+
+def mark_url_seen(conn, url: str, h: bytes):
+    _write(conn, "INSERT OR REPLACE INTO seen_urls VALUES (?, ?)", (url, h))
+
+def save_if_new(conn, h: bytes, tmp_path: str, fpath: str) -> bool:
+    """
+    Move tmp_path to fpath and record its hash as one unit: the hash is only committed
+    once the file is in place, so a failed rename can't leave content marked as seen.
+    On any failure (or if the hash was already known, returning False) tmp_path is left in place.
+    """
+    with _db_lock:
+        try:
+            if conn.execute("INSERT OR IGNORE INTO seen_hashes VALUES (?)", (h,)).rowcount != 1:
+                conn.rollback()
+                return False
+            os.replace(tmp_path, fpath)
+            try:
+                conn.commit()
+            except BaseException:
+                # Put the file back so it isn't saved without its hash on record
+                os.replace(fpath, tmp_path)
+                raise
+        except BaseException:
+            conn.rollback()
+            raise
+    return True
 
 def infer_extension_from_headers(headers, fallback=".jpg"):
     ctype = headers.get("Content-Type", "").lower()
@@ -91,9 +188,23 @@ def filename_from_url(url: str) -> str:
 from urllib.parse import urlparse
 
 REDDIT_IMAGE_HOSTS = {"i.redd.it", "preview.redd.it", "i.reddituploads.com"}
+_IMG_EXTS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".webp"})
+
+# Common shape of reddit image URLs, which can be normalized without a full parse
+_REDDIT_IMAGE_PREFIXES = tuple(f"{scheme}://{host}/" for scheme in ("https", "http") for host in REDDIT_IMAGE_HOSTS)
 
 def _normalize_reddit_image_url(u: str) -> str:
     # Keep only scheme, host, and path for reddit image hosts to avoid size/preview variants
+    if u.startswith(_REDDIT_IMAGE_PREFIXES) and ";" not in u:
+        for sep in ("?", "#"):
+            end = u.find(sep)
+            if end != -1:
+                u = u[:end]
+        return u
+    # Every reddit image host contains "redd"; anything else passes through unparsed
+    if "redd" not in u.lower():
+        return u
+    # Rarer shapes (uppercase host, no path, ;params): fall back to a full parse
     try:
         p = urlparse(u)
         host = p.netloc.lower()
@@ -103,11 +214,44 @@ def _normalize_reddit_image_url(u: str) -> str:
     except Exception:
         return u
 
-def get_image_urls_from_submission(submission) -> list[str]:
+def get_access_token(session: requests.Session) -> str:
+    # App-only OAuth token; one is valid for the whole run
+    r = session.post(
+        REDDIT_TOKEN_URL,
+        auth=(CLIENT_ID, CLIENT_SECRET),
+        data={"grant_type": "client_credentials"},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+def iter_new_submissions(session: requests.Session, token: str, limit: int):
+    """
+    Yield the raw JSON data of the newest `limit` posts in SUBREDDIT,
+    paging through the listing 100 (Reddit's max) at a time.
+    """
+    headers = {"Authorization": f"bearer {token}"}
+    after = None
+    while limit > 0:
+        params = {"limit": min(limit, 100), "raw_json": 1}
+        if after:
+            params["after"] = after
+        r = session.get(f"{REDDIT_API_BASE}/r/{SUBREDDIT}/new", headers=headers, params=params, timeout=30)
+        r.raise_for_status()
+        listing = r.json()["data"]
+        children = listing["children"]
+        for child in children:
+            yield child["data"]
+        limit -= len(children)
+        after = listing.get("after")
+        if not children or not after:
+            break
+
+def get_image_urls_from_submission(submission: dict) -> list[str]:
     """
-    Prefer the single, highest-quality source.
+    Prefer the single, highest-quality source, given a post's listing JSON.
     - Galleries: use media_metadata["s"]["u"] (the source), not preview 'p' sizes.
-    - Single-image reddit posts: use submission.url if it's on i.redd.it.
+    - Single-image reddit posts: use the post url if it's on i.redd.it.
     - Direct external images: accept .jpg/.png/.gif/.webp.
     - Avoid adding preview URLs if we already have a source.
     """
@@ -115,10 +259,11 @@ def get_image_urls_from_submission(submission) -> list[str]:
 
     # 1) Reddit galleries — use source image only
     try:
-        if getattr(submission, "is_gallery", False) and submission.media_metadata:
-            for item in submission.gallery_data["items"]:
+        media_metadata = submission.get("media_metadata")
+        if submission.get("is_gallery", False) and media_metadata:
+            for item in submission["gallery_data"]["items"]:
                 media_id = item["media_id"]
-                meta = submission.media_metadata.get(media_id, {})
+                meta = media_metadata.get(media_id, {})
                 src = (meta.get("s") or {}).get("u")
                 if src and src.startswith("http"):
                     urls.append(src.replace("&amp;", "&"))
@@ -129,7 +274,7 @@ def get_image_urls_from_submission(submission) -> list[str]:
 
     # 2) Single-image posts on reddit media (i.redd.it)
     if not urls:
-        u = submission.url or ""
+        u = submission.get("url") or ""
         if u.startswith("http"):
             host = urlparse(u).netloc.lower()
             if host in REDDIT_IMAGE_HOSTS:
@@ -138,15 +283,18 @@ def get_image_urls_from_submission(submission) -> list[str]:
 
     # 3) Direct external image links (not reddit-hosted)
     if not urls:
-        u = (submission.url or "")
-        if u.lower().startswith("http") and any(u.lower().endswith(ext) for ext in (".jpg", ".jpeg", ".png", ".gif", ".webp")):
-            urls.append(u)
+        u = (submission.get("url") or "")
+        if u[:4].lower() == "http":
+            ext = os.path.splitext(urlparse(u).path)[1].lower()
+            if ext in _IMG_EXTS:
+                urls.append(u)
 
     # 4) As a last resort, consider preview **only if** we still have nothing
     if not urls:
         try:
-            if submission.preview and "images" in submission.preview:
-                for img in submission.preview["images"]:
+            preview = submission.get("preview")
+            if preview and "images" in preview:
+                for img in preview["images"]:
                     src = img.get("source", {}).get("url")
                     if src and src.startswith("http"):
                         urls.append(src.replace("&amp;", "&"))
@@ -163,22 +311,15 @@ def get_image_urls_from_submission(submission) -> list[str]:
             seen.add(canon)
     return deduped
 
-def download_and_dedupe(url: str, post_id: str, idx: int, seen_hashes: set[str]) -> str | None:
+def download_and_dedupe(session: requests.Session, url: str, post_id: str, idx: int, conn: sqlite3.Connection) -> tuple[str | None, bytes]:
     """
-    Download URL, hash content, skip if hash already seen.
-    Returns the saved file path or None if skipped.
+    Download URL, hashing content as it streams to disk; skip if hash already seen.
+    New hashes are recorded in the state database. Safe to call from worker threads.
+    Returns (saved file path, hash); the path is None if the content was a duplicate.
     """
-    # Conservative headers for Reddit/CDNs
-    headers = {"User-Agent": USER_AGENT}
-    r = requests.get(url, headers=headers, timeout=30, stream=True)
+    r = session.get(url, timeout=30, stream=True)
     r.raise_for_status()
 
-    # Read content into memory to hash (images are usually small enough)
-    content = b"".join(r.iter_content(1024 * 64))
-    file_hash = sha256_bytes(content)
-    if file_hash in seen_hashes:
-        return None  # duplicate content
-
     # Decide filename + extension
     base = filename_from_url(url)
     _, ext = os.path.splitext(base)
@@ -187,71 +328,104 @@ def download_and_dedupe(url: str, post_id: str, idx: int, seen_hashes: set[str])
 
     fname = f"{post_id}_{idx}{ext}"
     fpath = os.path.join(SAVE_DIR, fname)
-    with open(fpath, "wb") as f:
-        f.write(content)
+    tmp_path = os.path.join(SAVE_DIR, f"{post_id}_{idx}.part")
+
+    # Hash and write in the same pass so only one chunk is held in memory
+    h = blake3()
+    try:
+        with open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                h.update(chunk)
+                f.write(chunk)
+    except Exception:
+        # open() itself may have failed; don't let that mask the real error
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+    # Dedup only needs content equality, so a 128-bit digest is plenty
+    file_hash = h.digest(length=HASH_BYTES)
+    try:
+        is_new = save_if_new(conn, file_hash, tmp_path, fpath)
+    except Exception:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    if not is_new:
+        os.unlink(tmp_path)
+        return None, file_hash  # duplicate content
+
+    # Be nice to the API/CDN
+    time.sleep(0.1)
     return fpath, file_hash
 
 # === Main ===
 def main():
     ensure_dirs()
-    state = load_state()
-    seen_post_ids = set(state.get("seen_post_ids", []))
-    seen_hashes = set(state.get("seen_hashes", []))
-
-    reddit = praw.Reddit(
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET,
-        user_agent=USER_AGENT,
-    )
-    reddit.read_only = True
+    conn = open_state()
 
-    sub = reddit.subreddit(SUBREDDIT)
+    session = make_session()
+    token = get_access_token(session)
     print(f"🔎 Checking r/{SUBREDDIT} (limit={POST_LIMIT})")
 
     downloaded = 0
     skipped_posts = 0
     skipped_hashes = 0
 
-    for submission in sub.new(limit=POST_LIMIT):
-        pid = submission.id
+    # Collect download jobs first, then fetch them concurrently
+    jobs = []
+    pending = {}  # post id -> downloads still in flight
+    for submission in iter_new_submissions(session, token, POST_LIMIT):
+        pid = submission["id"]
 
         # Skip if we've processed this post before
-        if pid in seen_post_ids:
+        if is_post_seen(conn, pid):
             skipped_posts += 1
             continue
 
-        urls = get_image_urls_from_submission(submission)
+        # URLs fetched on an earlier run (e.g. a partially downloaded gallery) need no new request
+        urls = []
+        for i, url in enumerate(get_image_urls_from_submission(submission), start=1):
+            if is_url_seen(conn, url):
+                skipped_hashes += 1
+            else:
+                urls.append((url, i))
         if not urls:
             # Mark the post as seen to avoid checking it every run
-            seen_post_ids.add(pid)
+            mark_post_seen(conn, pid)
             continue
 
-        found_any_for_post = False
-        for i, url in enumerate(urls, start=1):
+        pending[pid] = len(urls)
+        for url, i in urls:
+            jobs.append((url, pid, i))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(download_and_dedupe, session, url, pid, i, conn): (url, pid)
+            for url, pid, i in jobs
+        }
+        for fut in as_completed(futures):
+            url, pid = futures[fut]
             try:
-                res = download_and_dedupe(url, pid, i, seen_hashes)
-                if res is None:
+                fpath, h = fut.result()
+                mark_url_seen(conn, url, h)
+                if fpath is None:
                     skipped_hashes += 1
-                    continue
-                fpath, h = res
-                seen_hashes.add(h)
-                downloaded += 1
-                found_any_for_post = True
-                print(f"✅ Saved {os.path.basename(fpath)}")
-                # Be nice to the API/CDN
-                time.sleep(0.3)
+                else:
+                    downloaded += 1
+                    print(f"✅ Saved {os.path.basename(fpath)}")
             except requests.HTTPError as e:
                 print(f"❌ HTTP {e.response.status_code} for {url}")
             except Exception as e:
                 print(f"❌ Error downloading {url}: {e}")
 
-        # Even if no new file saved (all were dupes), mark post as seen so we don't re-process forever
-        seen_post_ids.add(pid)
+            # Once all of a post's images are handled (even if all were dupes), mark it seen
+            # so we don't re-process forever
+            pending[pid] -= 1
+            if not pending[pid]:
+                mark_post_seen(conn, pid)
 
-    # Persist state
-    state["seen_post_ids"] = sorted(seen_post_ids)
-    state["seen_hashes"] = sorted(seen_hashes)
-    save_state(state)
+    conn.close()
 
     print("\n— Summary —")
     print(f"New files downloaded: {downloaded}")
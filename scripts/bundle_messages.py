@@ -1,31 +1,24 @@
-import json
 from collections import defaultdict
 
-# Load your flat per-message JSON
-with open("data/messages_labeled.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
+from json_io import JsonArrayWriter, atomic_output, iter_json_array
 
-# Group messages by conversation_id
+# Stream your flat per-message JSON, grouping messages by conversation_id as they arrive
 bundled_dict = defaultdict(list)
-for msg in data:
-    convo_id = msg.get("conversation_id", "unknown")
-    bundled_dict[convo_id].append({
-        "speaker": msg.get("speaker", ""),
-        "text": msg.get("text", ""),
-        "timestamp": msg.get("timestamp"),
-        "label": msg.get("label", "")
-    })
+with open("data/messages_labeled.json", "rb") as f:
+    for msg in iter_json_array(f):
+        get = msg.get  # bind once instead of re-resolving the method for every field
+        bundled_dict[get("conversation_id", "unknown")].append({
+            "speaker": get("speaker", ""),
+            "text": get("text", ""),
+            "timestamp": get("timestamp"),
+            "label": get("label", "")
+        })
 
-# Build final bundled structure
-bundled = []
-for convo_id, messages in bundled_dict.items():
-    bundled.append({
-        "conversation_id": convo_id,
-        "messages": messages
-    })
+# Save bundled conversations, building each one only as it's written
+with atomic_output("data/conversations_bundled_with_labels.json") as f:
+    writer = JsonArrayWriter(f, indent=2)
+    for convo_id, messages in bundled_dict.items():
+        writer.write({"conversation_id": convo_id, "messages": messages})
+    writer.close()
 
-# Save bundled conversations
-with open("data/conversations_bundled_with_labels.json", "w", encoding="utf-8") as f:
-    json.dump(bundled, f, indent=2, ensure_ascii=False)
-
-print(f"✅ Bundled {len(bundled)} conversations with labels")
\ No newline at end of file
+print(f"✅ Bundled {writer.count} conversations with labels")
@@ -0,0 +1,51 @@
+"""
+Streaming JSON helpers shared by the message-processing scripts.
+"""
+import contextlib
+import json
+import os
+import textwrap
+
+# Optional: stream-parse input with ijson if available (falls back to loading it whole)
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def iter_json_array(f):
+    # Yield the elements of a top-level JSON array from a binary file
+    if ijson is None:
+        return iter(json.load(f))
+    return ijson.items(f, "item", use_float=True)
+
+class JsonArrayWriter:
+    """
+    Write a JSON array one element at a time, laid out exactly like
+    json.dump(items, f, indent=indent, ensure_ascii=False). `count` is the number written so far.
+    """
+    def __init__(self, f, indent):
+        self.f = f
+        self.indent = indent
+        self.count = 0
+
+    def write(self, item):
+        self.f.write(",\n" if self.count else "[\n")
+        self.f.write(textwrap.indent(json.dumps(item, indent=self.indent, ensure_ascii=False), " " * self.indent))
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]" if self.count else "[]")
+
+@contextlib.contextmanager
+def atomic_output(path):
+    # Write to path + ".tmp" and only replace path once everything succeeded,
+    # so a failure mid-stream never leaves a truncated output behind
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            yield f
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+    os.replace(tmp, path)
@@ -1,16 +1,30 @@
+import mmap
+import os
+
 FILE_PATH = "data/Message_data3.json"  # Adjust if needed
 LINE_LIMIT = 23502  # Change to the line number where your error begins
+SPEAKER_KEY = b'"speaker":'
 
 def count_messages(file_path, line_limit):
-    count = 0
-    with open(file_path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f, start=1):
-            if i >= line_limit:
-                break
-            if '"speaker":' in line:
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0  # mmap can't map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Find where line (line_limit - 1) ends
+            end = 0
+            for _ in range(line_limit - 1):
+                end = mm.find(b"\n", end) + 1
+                if not end:
+                    end = len(mm)
+                    break
+            # Count with bounded finds on the mapping itself, so the prefix is never copied
+            count = 0
+            pos = mm.find(SPEAKER_KEY, 0, end)
+            while pos != -1:
                 count += 1
-    return count
+                pos = mm.find(SPEAKER_KEY, pos + len(SPEAKER_KEY), end)
+            return count
 
 if __name__ == "__main__":
     total = count_messages(FILE_PATH, LINE_LIMIT)
-    print(f"✅ Total messages before line {LINE_LIMIT}: {total}")
\ No newline at end of file
+    print(f"✅ Total messages before line {LINE_LIMIT}: {total}")